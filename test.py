@@ -1,24 +1,118 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
-import pytesseract
+from typing import Optional, Dict, Any, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from PIL import Image
+import numpy as np
+import cv2
 import io
 import re
 import os
+import asyncio
+import multiprocessing
 from pathlib import Path
 
-pytesseract.pytesseract.tesseract_cmd = r'C:\Users\SMUTIKANT\AppData\Local\Programs\Tesseract-OCR\tesseract.exe'
 os.environ['TESSDATA_PREFIX'] = r'C:\Users\SMUTIKANT\AppData\Local\Programs\Tesseract-OCR\tessdata'
+# OpenMP contention slows down single-image OCR; must be set before Tesseract is loaded
+os.environ['OMP_THREAD_LIMIT'] = '1'
 
-app = FastAPI(title="KYC OCR Validation System")
+from tesserocr import PyTessBaseAPI, PSM, OEM
+
+# Each OCR worker process keeps its own Tesseract instance resident (see _init_worker),
+# so the LSTM model is loaded once per worker instead of once per request
+_API: Optional[PyTessBaseAPI] = None
+_POOL: Optional[ProcessPoolExecutor] = None
+
+# Longest edge (in pixels) of the image handed to Tesseract
+MAX_OCR_DIMENSION = 1600
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run OCR in a pool of single-threaded worker processes for the app's lifetime"""
+    global _POOL
+    # Spawn rather than fork: the server process already runs the event loop and threadpool threads
+    _POOL = ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker
+    )
+    yield
+    _POOL.shutdown()
+
+app = FastAPI(title="KYC OCR Validation System", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Precompiled patterns used by the validators
+_AADHAAR_RE = re.compile(r'\b\d{12}\b')
+_PAN_RE = re.compile(r'\b[A-Z]{5}[0-9]{4}[A-Z]\b')
+_DL_RE = re.compile(r'\b[A-Z]{2}[-\s]?\d{2}[-\s]?\d{11}\b')
+_DOB_RE = re.compile(r'(\d{2}[/-]\d{2}[/-]\d{4})')
+_GENDER_RE = re.compile(r'\b(MALE|FEMALE)\b', re.IGNORECASE)
+# PAN name: a strict letters-only name, falling back to any text before the next field
+_PAN_NAME_RE = re.compile(
+    r'(?:NAME)\s*:?\s*(?:'
+    r'(?P<strict>[A-Z][A-Z\s]{1,60}?)(?=\s*(?:GENDER|DOB|D\.O\.B|PAN\s*NUMBER|FATHER|$))'
+    r'|(?P<loose>.{1,80}?)(?=GENDER|DOB|PAN\s*NUMBER|$))',
+    re.IGNORECASE | re.DOTALL
+)
+# Only this much OCR text is scanned for the PAN name
+_PAN_NAME_SCAN_LIMIT = 2000
+_PAN_DOB_RE = re.compile(r'(?:DOB|D\.O\.B|DATE\s*OF\s*BIRTH)\s*:?\s*(\d{2}[-/]\d{2}[-/]\d{4})', re.IGNORECASE)
+_DL_DOB_RE = re.compile(r'(?:DOB|D\.O\.B|DATE OF BIRTH)[:\s]*(\d{2}[-/]\d{2}[-/]\d{4})', re.IGNORECASE)
+
+# Anchored patterns for manually entered data
+# Used with fullmatch(): '$' would also accept a trailing newline, which the checksum can't parse
+_MANUAL_AADHAAR_RE = re.compile(r'\d{12}', re.ASCII)
+_MANUAL_PAN_RE = re.compile(r'^[A-Z]{5}[0-9]{4}[A-Z]$')
+_MANUAL_DL_RE = re.compile(r'^[A-Z]{2}[-\s]?\d{2}[-\s]?\d{11}$')
+_MANUAL_DOB_RE = re.compile(r'^\d{2}[/-]\d{2}[/-]\d{4}$')
+
+# Verhoeff multiplication and permutation tables (the Aadhaar check digit scheme)
+_VERHOEFF_D = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9),
+    (1, 2, 3, 4, 0, 6, 7, 8, 9, 5),
+    (2, 3, 4, 0, 1, 7, 8, 9, 5, 6),
+    (3, 4, 0, 1, 2, 8, 9, 5, 6, 7),
+    (4, 0, 1, 2, 3, 9, 5, 6, 7, 8),
+    (5, 9, 8, 7, 6, 0, 4, 3, 2, 1),
+    (6, 5, 9, 8, 7, 1, 0, 4, 3, 2),
+    (7, 6, 5, 9, 8, 2, 1, 0, 4, 3),
+    (8, 7, 6, 5, 9, 3, 2, 1, 0, 4),
+    (9, 8, 7, 6, 5, 4, 3, 2, 1, 0),
+)
+_VERHOEFF_P = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9),
+    (1, 5, 7, 6, 2, 8, 3, 0, 9, 4),
+    (5, 8, 0, 3, 7, 9, 6, 1, 4, 2),
+    (8, 9, 1, 6, 0, 4, 3, 5, 2, 7),
+    (9, 4, 5, 3, 1, 2, 6, 8, 7, 0),
+    (4, 2, 8, 6, 5, 7, 3, 9, 0, 1),
+    (2, 7, 9, 3, 8, 0, 6, 4, 1, 5),
+    (7, 0, 4, 6, 9, 1, 3, 2, 5, 8),
+)
 
 # Create uploads directory
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Upload size limit and the chunk size used while reading uploads
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Image formats kept on disk and the extension a stored upload gets for each;
+# uploads in any other format are still validated, just not saved
+UPLOAD_EXTENSIONS = {
+    "JPEG": ".jpg",
+    "MPO": ".jpg",  # JPEG with an embedded MPF image (common phone camera export)
+    "GIF": ".gif",
+    "PNG": ".png",
+    "BMP": ".bmp",
+    "TIFF": ".tiff",
+    "WEBP": ".webp",
+}
+
 # Mount static files
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
@@ -36,6 +130,29 @@ class ValidationResult(BaseModel):
     validation_errors: list
     confidence: str
 
+def _validation_response(
+    success: bool,
+    document_type: str,
+    extracted_data: Dict[str, Any],
+    validation_errors: list,
+    confidence: str
+) -> ORJSONResponse:
+    """Serialize a ValidationResult payload directly with orjson, skipping model validation"""
+    return ORJSONResponse({
+        "success": success,
+        "document_type": document_type,
+        "extracted_data": extracted_data,
+        "validation_errors": validation_errors,
+        "confidence": confidence
+    })
+
+def is_valid_verhoeff(number: str) -> bool:
+    """Check the Verhoeff check digit of a string of digits"""
+    check = 0
+    for i, digit in enumerate(reversed(number)):
+        check = _VERHOEFF_D[check][_VERHOEFF_P[i % 8][int(digit)]]
+    return check == 0
+
 class DocumentValidator:
     
     @staticmethod
@@ -43,64 +160,52 @@ class DocumentValidator:
         """Validate and extract Aadhaar card details"""
         text = text.replace(" ", "").replace("\n", " ")
         
-        # Aadhaar number pattern: 12 digits
-        aadhaar_pattern = r'\b\d{12}\b'
-        aadhaar_match = re.search(aadhaar_pattern, text)
+        # Aadhaar number pattern: 12 digits; prefer the first run that passes the checksum,
+        # since other 12-digit runs (enrolment or phone fragments) may come before it
+        candidates = [match.group() for match in _AADHAAR_RE.finditer(text)]
+        aadhaar_number = next((number for number in candidates if is_valid_verhoeff(number)), None)
         
         # DOB pattern
-        dob_pattern = r'(\d{2}[/-]\d{2}[/-]\d{4})'
-        dob_match = re.search(dob_pattern, text)
+        dob_match = _DOB_RE.search(text)
         
         # Gender pattern
-        gender_pattern = r'\b(Male|Female|MALE|FEMALE)\b'
-        gender_match = re.search(gender_pattern, text, re.IGNORECASE)
+        gender_match = _GENDER_RE.search(text)
         
         errors = []
-        if not aadhaar_match:
+        if not candidates:
             errors.append("Aadhaar number not found or invalid format")
+        elif not aadhaar_number:
+            errors.append("Aadhaar number failed checksum validation")
         if not dob_match:
             errors.append("Date of birth not found")
             
         return {
-            "document_number": aadhaar_match.group() if aadhaar_match else None,
+            "document_number": aadhaar_number or (candidates[0] if candidates else None),
             "dob": dob_match.group() if dob_match else None,
             "gender": gender_match.group() if gender_match else None,
             "errors": errors
         }
     
     @staticmethod
-    def validate_pan(text: str) -> Dict[str, Any]:
+    def validate_pan(text: str, text_upper: str) -> Dict[str, Any]:
         """Validate and extract PAN card details"""
-        text_upper = text.upper()
         original_text = text
         
         # PAN pattern: 5 letters, 4 digits, 1 letter (e.g., ABCDE1234F)
-        pan_pattern = r'\b[A-Z]{5}[0-9]{4}[A-Z]\b'
-        pan_match = re.search(pan_pattern, text_upper)
+        pan_match = _PAN_RE.search(text_upper)
         
         # Improved name extraction - more flexible pattern
-        # Try multiple patterns to catch different formats
+        # A single scan tries the strict letters-only form first, then any text up to the next field
         name = None
+        name_match = _PAN_NAME_RE.search(original_text[:_PAN_NAME_SCAN_LIMIT])
         
-        # Pattern 1: "Name :" or "Name:" followed by text (case insensitive)
-        name_pattern1 = r'(?:NAME|Name)\s*:?\s*([A-Z][A-Z\s]+?)(?=\s*(?:Gender|GENDER|DOB|D\.O\.B|Pan\s*Number|PAN\s*NUMBER|Father|$))'
-        name_match1 = re.search(name_pattern1, original_text, re.IGNORECASE | re.DOTALL)
-        
-        if name_match1:
-            name = name_match1.group(1).strip()
+        if name_match:
+            name = name_match.group('strict') or name_match.group('loose').upper()
             # Clean up the name - remove extra whitespace
             name = ' '.join(name.split())
-        else:
-            # Pattern 2: Try to find name between "Name" and other fields
-            name_pattern2 = r'(?:NAME|Name)\s*:?\s*(.+?)(?=Gender|DOB|Pan\s*Number|$)'
-            name_match2 = re.search(name_pattern2, text_upper, re.IGNORECASE | re.DOTALL)
-            if name_match2:
-                name = name_match2.group(1).strip()
-                name = ' '.join(name.split())
         
         # DOB pattern - more flexible
-        dob_pattern = r'(?:DOB|D\.O\.B|Date\s*of\s*Birth)\s*:?\s*(\d{2}[-/]\d{2}[-/]\d{4})'
-        dob_match = re.search(dob_pattern, text_upper, re.IGNORECASE)
+        dob_match = _PAN_DOB_RE.search(text_upper)
         
         errors = []
         if not pan_match:
@@ -122,17 +227,15 @@ class DocumentValidator:
         }
     
     @staticmethod
-    def validate_driving_license(text: str) -> Dict[str, Any]:
+    def validate_driving_license(text: str, text_upper: str) -> Dict[str, Any]:
         """Validate and extract Driving License details"""
-        text = text.upper().replace("\n", " ")
+        text = text_upper.replace("\n", " ")
         
         # DL pattern: 2 letters (state code) + 2 digits + 4 digits + 7 digits
-        dl_pattern = r'\b[A-Z]{2}[-\s]?\d{2}[-\s]?\d{11}\b'
-        dl_match = re.search(dl_pattern, text)
+        dl_match = _DL_RE.search(text)
         
         # DOB pattern
-        dob_pattern = r'(?:DOB|D\.O\.B|DATE OF BIRTH)[:\s]*(\d{2}[-/]\d{2}[-/]\d{4})'
-        dob_match = re.search(dob_pattern, text, re.IGNORECASE)
+        dob_match = _DL_DOB_RE.search(text)
         
         errors = []
         if not dl_match:
@@ -148,45 +251,83 @@ class DocumentValidator:
 
 def perform_ocr(image: Image.Image) -> str:
     """Perform OCR on the image"""
-    try:
-        # Preprocess image for better OCR
+    # Downscale large photos; LSTM cost grows with the pixel count
+    if max(image.size) > MAX_OCR_DIMENSION:
+        image.thumbnail((MAX_OCR_DIMENSION, MAX_OCR_DIMENSION), Image.LANCZOS)
+    
+    # Preprocess image for better OCR
+    if image.mode != 'L':
         image = image.convert('L')  # Convert to grayscale
-        
-        # Enhance image for better OCR
-        from PIL import ImageEnhance
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(2)
-        
-        text = pytesseract.image_to_string(image, lang='eng')
-        
-        # Debug: print extracted text
-        print(f"Extracted text: {text}")
-        
-        if not text or text.strip() == "":
-            return "NO_TEXT_EXTRACTED"
-        
-        return text
-    except Exception as e:
-        print(f"OCR Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
+    gray = np.asarray(image)
+    
+    # Double the contrast around the mean (same as ImageEnhance.Contrast(2))
+    mean = int(cv2.mean(gray)[0] + 0.5)
+    contrast_lut = np.clip(np.arange(256) * 2 - mean, 0, 255).astype(np.uint8)
+    gray = cv2.LUT(gray, contrast_lut)
+    
+    # Binarize with a local threshold so uneven lighting doesn't garble the text
+    gray = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+    
+    if _API is None:
+        raise RuntimeError("Tesseract is not initialized; perform_ocr must run in an OCR worker")
+    _API.SetImage(Image.fromarray(gray))
+    text = _API.GetUTF8Text()
+    
+    # Debug: print extracted text
+    print(f"Extracted text: {text}")
+    
+    if not text or text.strip() == "":
+        return "NO_TEXT_EXTRACTED"
+    
+    return text
 
-def detect_document_type(text: str) -> str:
-    """Detect document type from extracted text"""
-    text_upper = text.upper()
+def _init_worker():
+    """Load the Tesseract model once in each OCR worker process"""
+    global _API
+    _API = PyTessBaseAPI(path=os.environ['TESSDATA_PREFIX'], lang='eng', psm=PSM.SINGLE_BLOCK, oem=OEM.LSTM_ONLY)
+
+def _ocr_bytes(contents: bytes) -> Tuple[str, Optional[str]]:
+    """Decode the uploaded image and run OCR on it (executed in a worker process)
+
+    Returns the extracted text and the decoded image format.
+    """
+    image = Image.open(io.BytesIO(contents))
+    image_format = image.format
+    return perform_ocr(image), image_format
+
+async def _read_upload(file: UploadFile) -> bytearray:
+    """Read the uploaded file in chunks, rejecting it once it exceeds MAX_UPLOAD_SIZE"""
+    too_large = HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_SIZE // (1024 * 1024)} MB)")
+    
+    # Reject up front when the size is already known
+    if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+        raise too_large
     
+    buffer = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        buffer += chunk
+        if len(buffer) > MAX_UPLOAD_SIZE:
+            raise too_large
+    return buffer
+
+def _save_upload(contents: bytes, file_path: Path) -> None:
+    """Write the uploaded bytes to disk as received"""
+    file_path.write_bytes(contents)
+
+def detect_document_type(text_upper: str) -> str:
+    """Detect document type from the upper-cased extracted text"""
+    # Cheap substring checks first; the PAN regex only runs when they all miss
     if "AADHAAR" in text_upper or "UNIQUE IDENTIFICATION" in text_upper:
         return "aadhaar"
-    elif "INCOME TAX" in text_upper or re.search(r'\b[A-Z]{5}[0-9]{4}[A-Z]\b', text_upper):
-        return "pan"
     elif "DRIVING LICENCE" in text_upper or "DRIVING LICENSE" in text_upper:
         return "driving_license"
+    elif "INCOME TAX" in text_upper or _PAN_RE.search(text_upper):
+        return "pan"
     else:
         return "unknown"
 
-@app.get("/", response_class=HTMLResponse)
-async def home():
-    """Serve the HTML interface"""
-    return """
+# Home page markup; the response is built once at import and reused
+_HOME_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -518,8 +659,16 @@ async def home():
     </html>
     """
 
+_HOME_RESPONSE = HTMLResponse(content=_HOME_HTML, headers={'cache-control': 'public, max-age=3600'})
+
+@app.get("/", response_class=HTMLResponse)
+async def home():
+    """Serve the HTML interface"""
+    return _HOME_RESPONSE
+
 @app.post("/validate-document", response_model=ValidationResult)
 async def validate_document(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     document_type: str = Form(...)
 ):
@@ -529,22 +678,26 @@ async def validate_document(
     if document_type not in ["aadhaar", "pan", "driving_license"]:
         raise HTTPException(status_code=400, detail="Invalid document type")
     
+    # The pool only exists while the app lifespan is running
+    if _POOL is None:
+        raise HTTPException(status_code=503, detail="OCR worker pool is not running")
+    
     # Read and process image
     try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        # Save image
-        file_path = UPLOAD_DIR / f"{file.filename}"
-        image.save(file_path)
+        contents = await _read_upload(file)
         
         print(f"Processing {document_type} document: {file.filename}")
         
-        # Perform OCR
-        extracted_text = perform_ocr(image)
+        # Perform OCR off the event loop
+        try:
+            loop = asyncio.get_running_loop()
+            extracted_text, image_format = await loop.run_in_executor(_POOL, _ocr_bytes, contents)
+        except Exception as e:
+            print(f"OCR Error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
         
         if extracted_text == "NO_TEXT_EXTRACTED":
-            return ValidationResult(
+            return _validation_response(
                 success=False,
                 document_type=document_type,
                 extracted_data={"error": "No text could be extracted from image"},
@@ -552,14 +705,17 @@ async def validate_document(
                 confidence="Low"
             )
         
+        # Normalize once and share it across the validators
+        text_upper = extracted_text.upper()
+        
         # Validate based on document type
         validator = DocumentValidator()
         if document_type == "aadhaar":
             result = validator.validate_aadhaar(extracted_text)
         elif document_type == "pan":
-            result = validator.validate_pan(extracted_text)
+            result = validator.validate_pan(extracted_text, text_upper)
         else:  # driving_license
-            result = validator.validate_driving_license(extracted_text)
+            result = validator.validate_driving_license(extracted_text, text_upper)
         
         # Determine confidence
         error_count = len(result["errors"])
@@ -570,7 +726,15 @@ async def validate_document(
         else:
             confidence = "Low"
         
-        return ValidationResult(
+        # Keep only successfully validated documents; written after the response is sent.
+        # The stored file is served publicly, so only known image formats are saved
+        if error_count == 0 and image_format in UPLOAD_EXTENSIONS:
+            # Drop any directory part and force the extension of the decoded format
+            stem = Path(file.filename or "").stem or "upload"
+            file_path = UPLOAD_DIR / f"{stem}{UPLOAD_EXTENSIONS[image_format]}"
+            background_tasks.add_task(_save_upload, contents, file_path)
+        
+        return _validation_response(
             success=error_count == 0,
             document_type=document_type,
             extracted_data=result,
@@ -594,27 +758,30 @@ async def validate_manual(data: KYCData):
     
     # Validate based on document type
     if data.document_type == "aadhaar":
-        if not data.document_number or not re.match(r'^\d{12}$', data.document_number.replace(" ", "")):
+        aadhaar = data.document_number.replace(" ", "") if data.document_number else ""
+        if not _MANUAL_AADHAAR_RE.fullmatch(aadhaar):
             errors.append("Invalid Aadhaar number format (should be 12 digits)")
+        elif not is_valid_verhoeff(aadhaar):
+            errors.append("Invalid Aadhaar number (checksum mismatch)")
     
     elif data.document_type == "pan":
-        if not data.document_number or not re.match(r'^[A-Z]{5}[0-9]{4}[A-Z]$', data.document_number.upper()):
+        if not data.document_number or not _MANUAL_PAN_RE.match(data.document_number.upper()):
             errors.append("Invalid PAN number format (e.g., ABCDE1234F)")
     
     elif data.document_type == "driving_license":
-        if not data.document_number or not re.match(r'^[A-Z]{2}[-\s]?\d{2}[-\s]?\d{11}$', data.document_number.upper()):
+        if not data.document_number or not _MANUAL_DL_RE.match(data.document_number.upper()):
             errors.append("Invalid Driving License format")
     
     else:
         raise HTTPException(status_code=400, detail="Invalid document type")
     
     # Validate DOB format if provided
-    if data.dob and not re.match(r'^\d{2}[/-]\d{2}[/-]\d{4}$', data.dob):
+    if data.dob and not _MANUAL_DOB_RE.match(data.dob):
         errors.append("Invalid date of birth format (use DD/MM/YYYY or DD-MM-YYYY)")
     
     confidence = "High" if len(errors) == 0 else "Low"
     
-    return ValidationResult(
+    return _validation_response(
         success=len(errors) == 0,
         document_type=data.document_type,
         extracted_data={